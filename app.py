@@ -1,82 +1,527 @@
-from flask import Flask, request, jsonify, g, current_app
+from flask import Flask, Request, Response, request, jsonify, g, current_app, stream_with_context
+from flask.json.provider import JSONProvider
 from flask_httpauth import HTTPBasicAuth
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
-from werkzeug.security import generate_password_hash, check_password_hash
 import os
+import contextlib
+import errno
+import hmac
+import json
+import orjson
+from io import BytesIO
+from tempfile import SpooledTemporaryFile, TemporaryFile
 from dotenv import load_dotenv
-from pydub import AudioSegment
+import openai
 from openai import OpenAI
 import httpx
-import traceback
+import tiktoken
+import subprocess
+import threading
 import sys
 import time
-from functools import wraps
-from logging_config import setup_logging, log_api_call, get_request_id
+import uuid
+from functools import lru_cache, wraps
+from celery.exceptions import Retry
+from celery.signals import worker_process_init
+from werkzeug.datastructures import FileStorage
+from logging_config import setup_logging, get_request_id, log_openai_response
 from paraphrase_logs import paraphrase_logger
+from paraphrase_cache import ParaphraseCache
+from paraphrase_batcher import ParaphraseBatcher
+from openai_quota import OpenAIQuotaManager, openai_retry
+from buffer_pool import BufferPool
+from celery_app import celery, BROKER_URL
+from redis_store import get_connection_pool
 from datetime import datetime, timedelta
 
 # Load environment variables
 load_dotenv()
 
-# Configure paths
-current_dir = os.path.dirname(os.path.abspath(__file__))
-TEMP_DIR = os.path.join(current_dir, "temp")
-os.makedirs(TEMP_DIR, exist_ok=True)
+# Uploads up to this size are kept in memory and handed to Whisper without touching disk
+UPLOAD_MEMORY_LIMIT = 10 * 1024 * 1024
+
+class UploadRequest(Request):
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        """Buffer uploads in memory up to UPLOAD_MEMORY_LIMIT instead of Werkzeug's 500 KB"""
+        if total_content_length is None:
+            return SpooledTemporaryFile(max_size=UPLOAD_MEMORY_LIMIT, mode="rb+")
+        if total_content_length <= UPLOAD_MEMORY_LIMIT:
+            return BytesIO()
+        return TemporaryFile("rb+")
+
+class OrjsonProvider(JSONProvider):
+    """Serialize JSON requests and responses with orjson, keeping Flask's sorted keys"""
+    options = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, option=self.options).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # Hand the encoded bytes straight to the response, without a str round trip
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj, option=self.options), mimetype="application/json")
 
 app = Flask(__name__)
+app.request_class = UploadRequest
+app.json = OrjsonProvider(app)
+# Werkzeug rejects larger requests from their Content-Length, before reading the body.
+# The default matches Whisper's own upload limit
+app.config["MAX_CONTENT_LENGTH"] = int(os.getenv("MAX_UPLOAD_MB", 25)) * 1024 * 1024
 auth = HTTPBasicAuth()
 
 # Set up logging
 setup_logging(app)
 
-# Configure OpenAI client
-client = OpenAI(
-    api_key=os.getenv("OPENAI_API_KEY"),
-    http_client=httpx.Client()
+# Configure OpenAI client. One pooled HTTP/2 client is shared by all threads so
+# calls reuse warm TLS connections instead of opening new ones
+OPENAI_POOL_LIMITS = httpx.Limits(
+    max_keepalive_connections=int(os.getenv("OPENAI_KEEPALIVE_CONNECTIONS", 64)),
+    max_connections=int(os.getenv("OPENAI_MAX_CONNECTIONS", 128)),
+    # Keep idle connections warm across gaps between requests
+    keepalive_expiry=float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", 60.0))
 )
 
-if not client.api_key or client.api_key == "your_openai_api_key":
+def create_openai_client():
+    """Build the OpenAI client; called again in each gunicorn worker after fork"""
+    return OpenAI(
+        api_key=os.getenv("OPENAI_API_KEY"),
+        # Retries are handled by openai_retry, outside the quota and Whisper slots,
+        # so the SDK's own retries would only multiply the attempts
+        max_retries=0,
+        http_client=httpx.Client(
+            http2=True,
+            limits=OPENAI_POOL_LIMITS,
+            timeout=httpx.Timeout(120.0, connect=5.0),
+            event_hooks={"response": [log_openai_response]}
+        )
+    )
+
+client = create_openai_client()
+
+API_KEY_OK = bool(client.api_key) and client.api_key != "your_openai_api_key"
+if not API_KEY_OK:
     app.logger.error("OpenAI API key not found. Please set OPENAI_API_KEY in .env file")
 
+# The API has a single user; its credentials are encoded once for the per-request comparison
+API_USERNAME = os.getenv("API_USERNAME", "")
+API_USERNAME_BYTES = API_USERNAME.encode()
+API_PASSWORD_BYTES = os.getenv("API_PASSWORD", "").encode()
+AUTH_CONFIGURED = bool(API_USERNAME_BYTES and API_PASSWORD_BYTES)
+if not AUTH_CONFIGURED:
+    app.logger.error("API_USERNAME and API_PASSWORD are not set; every authenticated request will be rejected")
+
+# Client-side OpenAI limits, so bursts wait for capacity instead of failing with 429s
+quota = OpenAIQuotaManager(
+    rpm=int(os.getenv("OPENAI_RPM", 5000)),
+    tpm=int(os.getenv("OPENAI_TPM", 15_000_000)),
+    max_concurrent_requests=int(os.getenv("OPENAI_MAX_CONCURRENCY", 250))
+)
+
+# Repeated inputs are answered from the cache instead of another OpenAI call
+paraphrase_cache = ParaphraseCache(
+    ttl=int(os.getenv("PARAPHRASE_CACHE_TTL", 86400)),
+    stale_ttl=int(os.getenv("PARAPHRASE_STALE_TTL", 7 * 86400))
+)
+
+PARAPHRASE_MODEL = "gpt-4o-mini"
+PARAPHRASE_SYSTEM_PROMPT = "You are a helpful assistant that paraphrases text to make it more clear and concise while preserving the original meaning.keep the original language and do not translate."
+
+# Longer inputs can't fit the model's context window alongside the paraphrase
+MAX_INPUT_TOKENS = 100_000
+
+@lru_cache(maxsize=None)
+def get_encoding(model):
+    """Load a model's tokenizer once per process; the encoder is thread-safe"""
+    return tiktoken.encoding_for_model(model)
+
+# tiktoken downloads the encoding on first use. If that fails, token counts are
+# estimated and the download is retried at most this often
+ENCODING_RETRY_INTERVAL = 300.0
+_encoding_retry_at = 0.0
+
+def count_tokens(text, model=PARAPHRASE_MODEL):
+    """Count the tokens the model will see for the given text, or estimate them"""
+    global _encoding_retry_at
+    if time.monotonic() >= _encoding_retry_at:
+        try:
+            return len(get_encoding(model).encode(text))
+        except Exception as e:
+            _encoding_retry_at = time.monotonic() + ENCODING_RETRY_INTERVAL
+            app.logger.warning("Could not load the %s tokenizer, estimating token counts: %s", model, e)
+    # Roughly four characters per token for English text
+    return len(text) // 4 + 1
+
+# Whisper has its own, much lower, rate limit, so cap concurrent uploads separately
+whisper_slots = threading.BoundedSemaphore(int(os.getenv("WHISPER_CONCURRENCY", 4)))
+
+@openai_retry
+def create_transcription(audio):
+    """Transcribe an audio file with the Whisper API"""
+    with whisper_slots, quota.reserve():
+        return client.audio.transcriptions.create(
+            model="whisper-1",
+            file=audio
+        )
+
+class ReservedStream:
+    """An OpenAI stream that holds its quota reservation until it is read or closed"""
+
+    def __init__(self, stream, reservation):
+        self._stream = stream
+        self._reservation = reservation
+
+    def __iter__(self):
+        try:
+            yield from self._stream
+        finally:
+            self.close()
+
+    def close(self):
+        # Safe to call more than once: the ExitStack releases the slot only once
+        self._reservation.close()
+        self._stream.response.close()
+
+@openai_retry
+def create_paraphrase(text, input_tokens, stream=False):
+    """Ask the chat model to paraphrase the text, optionally as a stream of chunks"""
+    # Each attempt makes its own reservation, so retries don't hold a slot while waiting
+    with contextlib.ExitStack() as reservation:
+        # The paraphrase comes back roughly as long as the input
+        reservation.enter_context(quota.reserve(tokens=2 * input_tokens))
+        response = client.chat.completions.create(
+            model=PARAPHRASE_MODEL,
+            messages=[
+                {"role": "system", "content": PARAPHRASE_SYSTEM_PROMPT},
+                {"role": "user", "content": f"Please paraphrase this text: {text}"}
+            ],
+            stream=stream
+        )
+        if stream:
+            # OpenAI is still generating when create() returns a stream
+            return ReservedStream(response, reservation.pop_all())
+        return response
+
+BATCH_SYSTEM_PROMPT = PARAPHRASE_SYSTEM_PROMPT + " You will be given a JSON object of numbered texts. Paraphrase each text separately and reply with a JSON object mapping each number to its paraphrase."
+
+# Only short texts are batched, so a batch always fits the model's context window
+BATCH_MAX_INPUT_TOKENS = 2_000
+
+@openai_retry
+def create_batch_paraphrase(numbered_texts, input_tokens):
+    """Ask the chat model to paraphrase several numbered texts in one call"""
+    with quota.reserve(tokens=2 * input_tokens):
+        return client.chat.completions.create(
+            model=PARAPHRASE_MODEL,
+            messages=[
+                {"role": "system", "content": BATCH_SYSTEM_PROMPT},
+                {"role": "user", "content": json.dumps(numbered_texts, ensure_ascii=False)}
+            ],
+            response_format={"type": "json_object"}
+        )
+
+def _paraphrase_one(text, input_tokens):
+    response = create_paraphrase(text, input_tokens)
+    return response.choices[0].message.content.strip()
+
+def paraphrase_batch(items):
+    """Paraphrase a batch of (text, input_tokens) pairs with a single chat call.
+
+    Texts the model leaves out of its reply are paraphrased on their own instead.
+    """
+    if len(items) == 1:
+        return [_paraphrase_one(*items[0])]
+
+    numbered_texts = {str(number): text for number, (text, _) in enumerate(items, 1)}
+    response = create_batch_paraphrase(numbered_texts, sum(tokens for _, tokens in items))
+    try:
+        paraphrases = json.loads(response.choices[0].message.content)
+    except ValueError:
+        paraphrases = {}
+    if not isinstance(paraphrases, dict):
+        paraphrases = {}
+
+    app.logger.info("Paraphrased a batch of %s texts", len(items))
+    results = []
+    for number, item in zip(numbered_texts, items):
+        paraphrased = paraphrases.get(number)
+        if isinstance(paraphrased, str) and paraphrased.strip():
+            results.append(paraphrased.strip())
+        else:
+            results.append(_paraphrase_one(*item))
+    return results
+
+# Short paraphrase requests arriving within this window share one OpenAI call; 0 disables batching
+PARAPHRASE_BATCH_WINDOW_MS = int(os.getenv("PARAPHRASE_BATCH_WINDOW_MS", 0))
+paraphrase_batcher = ParaphraseBatcher(
+    paraphrase_batch,
+    window=PARAPHRASE_BATCH_WINDOW_MS / 1000
+) if PARAPHRASE_BATCH_WINDOW_MS else None
+
 # Configure rate limiter
 def get_auth_username():
-    auth_username = auth.get_auth()
-    return auth_username if auth_username else get_remote_address()
+    # Limits are checked before login_required runs, so only key by the username once
+    # the credentials are known to be valid; failed logins count against the client IP
+    credentials = request.authorization
+    if credentials and credentials.type == "basic":
+        username = verify_password(credentials.username or "", credentials.password or "")
+        if username:
+            return username
+    return get_remote_address()
 
+# Keep counters in Redis when configured so limits hold across workers and restarts.
+# The moving window is checked and updated by a single Lua script per hit, over
+# the same bounded connection pool as the rest of the app
+redis_pool = get_connection_pool()
 limiter = Limiter(
     key_func=get_auth_username,  # Rate limit by authenticated username or IP
     app=app,
     default_limits=["200 per day", "50 per hour"],  # Global limits
+    storage_uri=os.getenv("REDIS_URL", "memory://"),
+    storage_options={"connection_pool": redis_pool} if redis_pool else {},
+    strategy="moving-window",
+    # A Redis outage must not fail requests: count in memory until it is back
+    swallow_errors=True,
+    in_memory_fallback_enabled=True,
 )
 
+# Audio formats the Whisper API accepts as-is; anything else is converted to mp3 first
+WHISPER_FORMATS = {"flac", "m4a", "mp3", "mp4", "mpeg", "mpga", "oga", "ogg", "wav", "webm"}
+
+def get_audio_format(filename):
+    """Return the lower-cased extension of an uploaded file name"""
+    return os.path.splitext(filename)[1].lower().lstrip(".")
+
+# Containers that may keep their index at the end of the file; ffmpeg has to
+# seek to read them, which it cannot do on a pipe
+SEEKABLE_FORMATS = {"3g2", "3gp", "mov"}
+
+def _ffmpeg_mp3_command(input_arg):
+    # Whisper works on 16 kHz mono audio, so downmix and resample before upload;
+    # 32 kbps is plenty for speech at that rate
+    return ["ffmpeg", "-loglevel", "error", "-i", input_arg, "-ac", "1", "-ar", "16000",
+            "-f", "mp3", "-c:a", "libmp3lame", "-b:a", "32k", "pipe:1"]
+
+def _feed_stdin(stream, stdin):
+    """Copy an upload into ffmpeg's stdin, closing the pipe when done"""
+    try:
+        copy_buffers.copy(stream, stdin)
+    except BrokenPipeError:
+        # ffmpeg exited early; its exit code reports the failure
+        pass
+    finally:
+        try:
+            stdin.close()
+        except BrokenPipeError:
+            pass
+
+# Scratch copies of in-memory uploads go to the system temp dir unless SCRATCH_DIR names
+# another, e.g. /dev/shm to keep them off disk. Each is at most UPLOAD_MEMORY_LIMIT and
+# there is one per running conversion in every worker, so a small tmpfs can fill up;
+# copies then fall back to the system temp dir
+SCRATCH_DIR = os.getenv("SCRATCH_DIR") or None
+
+# Cap concurrent ffmpeg processes; further conversions wait. The semaphore exists in
+# every worker process, so FFMPEG_CONCURRENCY is per worker and by default the CPUs
+# are split between the WEB_CONCURRENCY workers
+FFMPEG_CONCURRENCY = int(os.getenv(
+    "FFMPEG_CONCURRENCY",
+    max(1, (os.cpu_count() or 1) // int(os.getenv("WEB_CONCURRENCY", 1)))
+))
+conversion_slots = threading.BoundedSemaphore(FFMPEG_CONCURRENCY)
+
+# One reusable 1 MB copy buffer per conversion slot
+copy_buffers = BufferPool(count=FFMPEG_CONCURRENCY, size=1024 * 1024)
+
+def convert_to_mp3(file, audio_format):
+    """Convert an uploaded audio file to mp3 with ffmpeg and return the encoded bytes.
+
+    Streamable formats are piped into ffmpeg's stdin. Containers that ffmpeg has to
+    seek in (SEEKABLE_FORMATS) are read from the upload's file on disk, or from a
+    scratch copy in SCRATCH_DIR if the upload is held in memory. Either way the mp3
+    comes back through a pipe and is returned as bytes held in memory.
+    """
+    with conversion_slots:
+        return _convert_to_mp3(file, audio_format)
+
+def _scratch_copy(stream, directory=SCRATCH_DIR):
+    """Copy an upload to an anonymous temp file in directory, or in the system temp dir if it is full"""
+    scratch = TemporaryFile("w+b", dir=directory)
+    try:
+        copy_buffers.copy(stream, scratch)
+        scratch.flush()
+    except OSError as e:
+        # Closing flushes whatever is still buffered, which fails the same way
+        with contextlib.suppress(OSError):
+            scratch.close()
+        if directory is None or e.errno != errno.ENOSPC:
+            raise
+        app.logger.warning("Scratch directory %s is full, using the system temp dir", directory)
+        stream.seek(0)
+        return _scratch_copy(stream, None)
+    return scratch
+
+def _convert_to_mp3(file, audio_format):
+    if audio_format in SEEKABLE_FORMATS:
+        # Hand ffmpeg a real file descriptor it can seek in. Uploads buffered in
+        # memory are copied to an anonymous temp file (O_TMPFILE on Linux), which
+        # the kernel deletes when it is closed, so there is nothing to clean up.
+        try:
+            file.stream.fileno()
+            source = file.stream
+        except (AttributeError, OSError):
+            source = _scratch_copy(file.stream)
+        try:
+            fd = source.fileno()
+            result = subprocess.run(_ffmpeg_mp3_command(f"/proc/self/fd/{fd}"), pass_fds=(fd,),
+                                    stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True)
+        finally:
+            if source is not file.stream:
+                source.close()
+        return result.stdout
+
+    command = _ffmpeg_mp3_command("pipe:0")
+    proc = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                            stderr=subprocess.DEVNULL)
+    feeder = threading.Thread(target=_feed_stdin, args=(file.stream, proc.stdin), daemon=True)
+    feeder.start()
+    try:
+        mp3_data = proc.stdout.read()
+    except BaseException:
+        # Don't leave ffmpeg running, or wait on it, if reading its output fails
+        proc.kill()
+        raise
+    finally:
+        proc.stdout.close()
+        returncode = proc.wait()
+        feeder.join()
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, command)
+    return mp3_data
+
+def _error_response(message, status_code):
+    """Build a JSON error response, keeping the message in g for the request logs"""
+    g.error_message = message
+    return jsonify({"error": message}), status_code
+
+def _error_if_no_key():
+    """Return an error response when the OpenAI API key is missing, otherwise None"""
+    if API_KEY_OK:
+        return None
+    app.logger.error("OpenAI API key not configured")
+    return _error_response("OpenAI API key not configured. Please set OPENAI_API_KEY in .env file", 500)
+
+def _error_if_no_broker():
+    """Return an error response when background transcription is not configured, otherwise None"""
+    if BROKER_URL:
+        return None
+    app.logger.error("Background transcription requested but no Celery broker is configured")
+    return _error_response("Background transcription is not configured. Please set CELERY_BROKER_URL", 503)
+
+def _get_upload():
+    """Return the uploaded audio file and None, or None and an error response"""
+    if "file" not in request.files:
+        app.logger.error("No file part in request")
+        return None, _error_response("No file part", 400)
+
+    file = request.files["file"]
+    if file.filename == "":
+        app.logger.error("No selected file")
+        return None, _error_response("No selected file", 400)
+    return file, None
+
+def _run_whisper(file):
+    """Transcribe an uploaded audio file, converting it first if Whisper can't read it"""
+    audio_format = get_audio_format(file.filename)
+    if audio_format in WHISPER_FORMATS:
+        # Whisper accepts this format natively, so send the upload as-is
+        audio = (f"audio.{audio_format}", file.stream, file.mimetype or None)
+    else:
+        audio = ("audio.mp3", convert_to_mp3(file, audio_format), "audio/mpeg")
+        app.logger.info("File converted to MP3")
+
+    # Transcribe using OpenAI's Whisper API
+    app.logger.info("Starting transcription with Whisper API")
+    return create_transcription(audio).text
+
+# Uploads queued for background transcription wait here until a Celery worker
+# picks them up, so the worker has to share this directory with the web process
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "temp"))
+
+# OpenAI failures worth retrying the whole task for, after create_transcription's
+# own retries have given up. APITimeoutError is an APIConnectionError
+TRANSIENT_OPENAI_ERRORS = (openai.APIConnectionError, openai.InternalServerError)
+
+def init_worker_process():
+    """Replace state a forked worker must not share with the process that imported the app"""
+    global client
+    # httpx connection pools must not be shared across processes
+    client = create_openai_client()
+    # Nothing else needs replacing: Redis connection pools notice the new PID and
+    # reconnect, the log handlers open their files per record, and the paraphrase
+    # batcher and log writer start their threads lazily in each process
+
+@worker_process_init.connect
+def init_celery_worker_process(**kwargs):
+    init_worker_process()
+
+@celery.task(name="transcribe_upload", bind=True, max_retries=3)
+def transcribe_upload(self, path, mimetype=None):
+    """Transcribe a saved upload in a Celery worker and delete it once done"""
+    retrying = False
+    try:
+        with open(path, "rb") as stream:
+            return _run_whisper(FileStorage(stream=stream, filename=path, content_type=mimetype))
+    except TRANSIENT_OPENAI_ERRORS as exc:
+        if self.request.retries < self.max_retries:
+            app.logger.warning("Transient OpenAI error, retrying transcription: %s", exc)
+            try:
+                raise self.retry(exc=exc, countdown=2 ** self.request.retries)
+            except Retry:
+                # Only keep the upload once the retry has been published; if that
+                # fails, this attempt is the last one
+                retrying = True
+                raise
+        raise
+    finally:
+        if not retrying:
+            os.remove(path)
+
 # Decorator to monitor API calls
 def monitor_api_call(endpoint_name):
     def decorator(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
             g.request_id = get_request_id()
-            app.logger.info(f"[{g.request_id}] Starting {endpoint_name} request")
-            start_time = time.time()
+            app.logger.info("Starting %s request", endpoint_name)
+            start_time = time.perf_counter()
             
             try:
                 response = f(*args, **kwargs)
-                duration = time.time() - start_time
+                duration = time.perf_counter() - start_time
                 
                 # Log the API call completion
                 status_code = response[1] if isinstance(response, tuple) else 200
-                app.logger.info(
-                    f"[{g.request_id}] Completed {endpoint_name} request. "
-                    f"Duration: {duration:.2f}s, Status: {status_code}"
-                )
+                error_message = g.get("error_message")
+                if error_message:
+                    app.logger.info(
+                        "Completed %s request. Duration: %.2fs, Status: %s, Error: %s",
+                        endpoint_name, duration, status_code, error_message
+                    )
+                else:
+                    app.logger.info(
+                        "Completed %s request. Duration: %.2fs, Status: %s",
+                        endpoint_name, duration, status_code
+                    )
                 return response
             
             except Exception as e:
-                duration = time.time() - start_time
-                app.logger.error(
-                    f"[{g.request_id}] Error in {endpoint_name} request. "
-                    f"Duration: {duration:.2f}s\n{traceback.format_exc()}"
-                )
+                duration = time.perf_counter() - start_time
+                # The traceback is logged once, by the exception handler that sees it next
+                app.logger.error("Error in %s request. Duration: %.2fs, Error: %s", endpoint_name, duration, e)
                 raise
             
         return decorated_function
@@ -84,120 +529,154 @@ def monitor_api_call(endpoint_name):
 
 @auth.verify_password
 def verify_password(username, password):
-    if username == os.getenv("API_USERNAME") and password == os.getenv("API_PASSWORD"):
-        return username
+    if not AUTH_CONFIGURED:
+        return None
+    # Constant-time comparisons, so response timing doesn't leak the credentials
+    username_ok = hmac.compare_digest(username.encode(), API_USERNAME_BYTES)
+    password_ok = hmac.compare_digest(password.encode(), API_PASSWORD_BYTES)
+    if username_ok and password_ok:
+        return API_USERNAME
     return None
 
+# API documentation served by the index and 404 handlers
+ENDPOINTS = {
+    "/": "API documentation",
+    "/api/v1/transcribe": "POST - Upload audio file for transcription (returns text/plain)",
+    "/api/v1/paraphrase": "POST - Paraphrase text (returns text/plain)",
+    "/api/v1/paraphrase_logs": "GET - View paraphrase logs (returns text/plain or JSON)",
+    "/api/v1/paraphrase_logs/summary": "GET - View paraphrase logs summary (returns JSON)",
+    "/api/v1/transcribe_with_time": "POST - Upload audio file for transcription with timestamp (returns text/plain)",
+    "/api/v1/transcribe_async": "POST - Queue audio file for background transcription (returns JSON task id)",
+    "/api/v1/tasks/<task_id>": "GET - Status and result of a background transcription (returns JSON)"
+}
+
+# The index and 404 bodies never change, so they are encoded once at import
+JSON_HEADERS = {"Content-Type": "application/json"}
+INDEX_BODY = orjson.dumps({
+    "message": "Welcome to Voice Note Taker API",
+    "endpoints": ENDPOINTS
+})
+NOT_FOUND_BODY = orjson.dumps({
+    "error": "The requested URL was not found",
+    "available_endpoints": ENDPOINTS
+})
+
+# Not wrapped in monitor_api_call: health checks hit this route constantly
 @app.route("/")
 @auth.login_required
 def index():
-    return jsonify({
-        "message": "Welcome to Voice Note Taker API",
-        "endpoints": {
-            "/": "API documentation",
-            "/api/v1/transcribe": "POST - Upload audio file for transcription (returns text/plain)",
-            "/api/v1/paraphrase": "POST - Paraphrase text (returns text/plain)",
-            "/api/v1/paraphrase_logs": "GET - View paraphrase logs (returns text/plain or JSON)",
-            "/api/v1/paraphrase_logs/summary": "GET - View paraphrase logs summary (returns JSON)",
-            "/api/v1/transcribe_with_time": "POST - Upload audio file for transcription with timestamp (returns text/plain)"
-        }
-    })
+    return INDEX_BODY, 200, JSON_HEADERS
 
 @app.route("/api/v1/transcribe", methods=["POST"])
 @auth.login_required
 @limiter.limit("10 per minute")  # Stricter limit for resource-intensive endpoint
 @monitor_api_call('transcribe')
 def transcribe():
-    if not client.api_key or client.api_key == "your_openai_api_key":
-        app.logger.error(f"[{g.request_id}] OpenAI API key not configured")
-        return jsonify({"error": "OpenAI API key not configured. Please set OPENAI_API_KEY in .env file"}), 500
+    error = _error_if_no_key()
+    if error:
+        return error
 
-    if "file" not in request.files:
-        app.logger.error(f"[{g.request_id}] No file part in request")
-        return jsonify({"error": "No file part"}), 400
-    
-    file = request.files["file"]
-    if file.filename == "":
-        app.logger.error(f"[{g.request_id}] No selected file")
-        return jsonify({"error": "No selected file"}), 400
+    file, error = _get_upload()
+    if error:
+        return error
 
     try:
-        # Generate a unique filename
-        temp_path = os.path.join(TEMP_DIR, f"temp_{g.request_id}")
-        
-        # Save the uploaded file
-        file.save(temp_path)
-        app.logger.info(f"[{g.request_id}] File saved to {temp_path}")
-        
-        try:
-            # Convert to mp3 (required by Whisper API)
-            audio = AudioSegment.from_file(temp_path)
-            audio.export(temp_path + ".mp3", format="mp3")
-            app.logger.info(f"[{g.request_id}] File converted to MP3")
-            
-            # Transcribe using OpenAI's Whisper API
-            with open(temp_path + ".mp3", "rb") as audio_file:
-                app.logger.info(f"[{g.request_id}] Starting transcription with Whisper API")
-                transcript = client.audio.transcriptions.create(
-                    model="whisper-1",
-                    file=audio_file
-                )
-                
-            app.logger.info(f"[{g.request_id}] Successfully transcribed audio")
-            return transcript.text + "\n\n" + "Paraphrased version is below.", 200, {'Content-Type': 'text/plain'}
-            
-        finally:
-            # Clean up temporary files
-            try:
-                os.remove(temp_path)
-                os.remove(temp_path + ".mp3")
-                app.logger.info(f"[{g.request_id}] Cleaned up temporary files")
-            except Exception as e:
-                app.logger.warning(f"[{g.request_id}] Error cleaning up files: {str(e)}")
+        transcript = _run_whisper(file)
+
+        app.logger.info("Successfully transcribed audio")
+        return transcript + "\n\n" + "Paraphrased version is below.", 200, {'Content-Type': 'text/plain'}
     
     except Exception as e:
-        app.logger.error(f"[{g.request_id}] Error processing audio: {str(e)}\n{traceback.format_exc()}")
-        return jsonify({"error": "Error processing audio file"}), 500
+        app.logger.exception("Error processing audio: %s", e)
+        return _error_response("Error processing audio file", 500)
 
 @app.route("/api/v1/paraphrase", methods=["POST"])
 @auth.login_required
 @limiter.limit("30 per minute")  # Less strict limit for text-based endpoint
 @monitor_api_call('paraphrase')
 def get_paraphrase():
-    if not client.api_key or client.api_key == "your_openai_api_key":
-        app.logger.error(f"[{g.request_id}] OpenAI API key not configured")
-        return jsonify({"error": "OpenAI API key not configured"}), 500
+    error = _error_if_no_key()
+    if error:
+        return error
 
     if not request.is_json:
-        app.logger.error(f"[{g.request_id}] Request must be JSON")
-        return jsonify({"error": "Request must be JSON"}), 400
+        app.logger.error("Request must be JSON")
+        return _error_response("Request must be JSON", 400)
     
     text = request.json.get("text")
     if not text:
-        app.logger.error(f"[{g.request_id}] No text provided")
-        return jsonify({"error": "No text provided"}), 400
+        app.logger.error("No text provided")
+        return _error_response("No text provided", 400)
     
+    cache_key = ParaphraseCache.make_key(PARAPHRASE_MODEL, PARAPHRASE_SYSTEM_PROMPT, text)
     try:
-        app.logger.info(f"[{g.request_id}] Processing paraphrase request")
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",  
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant that paraphrases text to make it more clear and concise while preserving the original meaning.keep the original language and do not translate."}, 
-                {"role": "user", "content": f"Please paraphrase this text: {text}"}
-            ]
-        )
-        
-        app.logger.info(f"[{g.request_id}] Successfully received paraphrase response")
-        paraphrased = response.choices[0].message.content.strip()
-        
+        app.logger.info("Processing paraphrase request")
+        paraphrased = paraphrase_cache.get(cache_key)
+        if paraphrased is not None:
+            app.logger.info("Serving paraphrase from cache")
+
+            # Log the paraphrase result
+            paraphrase_logger.log_paraphrase(g.request_id, text, paraphrased)
+
+            # Return plain text with Content-Type header
+            return text + "\n\n" + paraphrased, 200, {'Content-Type': 'text/plain'}
+
+        # Reject inputs the model can't accept without paying for the round trip
+        input_tokens = count_tokens(text)
+        if input_tokens > MAX_INPUT_TOKENS:
+            app.logger.error("Text too long: %s tokens", input_tokens)
+            return _error_response(f"Text too long. The limit is {MAX_INPUT_TOKENS} tokens", 413)
+
+        if paraphrase_batcher is not None and input_tokens <= BATCH_MAX_INPUT_TOKENS:
+            paraphrased = paraphrase_batcher.submit((text, input_tokens))
+            paraphrase_cache.set(cache_key, paraphrased)
+
+            # Log the paraphrase result
+            paraphrase_logger.log_paraphrase(g.request_id, text, paraphrased)
+
+            return text + "\n\n" + paraphrased, 200, {'Content-Type': 'text/plain'}
+
+        stream = create_paraphrase(text, input_tokens, stream=True)
+    except Exception as e:
+        app.logger.exception("Error paraphrasing text: %s", e)
+        # Fall back to the last paraphrase of this text, even if it has expired
+        paraphrased = paraphrase_cache.get_stale(cache_key)
+        if paraphrased is not None:
+            app.logger.warning("Serving stale paraphrase from cache")
+            paraphrase_logger.log_paraphrase(g.request_id, text, paraphrased, stale=True)
+            return text + "\n\n" + paraphrased, 200, {'Content-Type': 'text/plain'}
+        return _error_response("Error paraphrasing text", 500)
+
+    def generate():
+        # Send the original text right away, then the paraphrase as OpenAI produces it
+        yield text + "\n\n"
+        parts = []
+        try:
+            for chunk in stream:
+                content = chunk.choices[0].delta.content if chunk.choices else None
+                if not content:
+                    continue
+                if not parts:
+                    content = content.lstrip()
+                    if not content:
+                        continue
+                parts.append(content)
+                yield content
+        except Exception as e:
+            app.logger.exception("Error streaming paraphrase: %s", e)
+            return
+
+        app.logger.info("Successfully received paraphrase response")
+        paraphrased = "".join(parts).strip()
+        paraphrase_cache.set(cache_key, paraphrased)
+
         # Log the paraphrase result
         paraphrase_logger.log_paraphrase(g.request_id, text, paraphrased)
-        
-        # Return plain text with Content-Type header
-        return text + "\n\n" + paraphrased, 200, {'Content-Type': 'text/plain'}
-    except Exception as e:
-        app.logger.error(f"[{g.request_id}] Error paraphrasing text: {str(e)}\n{traceback.format_exc()}")
-        return jsonify({"error": "Error paraphrasing text"}), 500
+
+    response = Response(stream_with_context(generate()), mimetype="text/plain")
+    # Covers clients that disconnect before the body is read
+    response.call_on_close(stream.close)
+    return response
 
 @app.route("/api/v1/paraphrase_logs", methods=["GET"])
 @auth.login_required
@@ -227,7 +706,7 @@ def get_paraphrase_logs():
                     f"Request ID: {log['request_id']}",
                     "Original Text:",
                     log['original_text'],
-                    "Paraphrased Text:",
+                    "Paraphrased Text (stale):" if log.get('stale') else "Paraphrased Text:",
                     log['paraphrased_text'],
                     "-" * 80  # Separator
                 ])
@@ -237,11 +716,11 @@ def get_paraphrase_logs():
             return jsonify({"logs": logs}), 200
 
     except ValueError as e:
-        app.logger.error(f"[{g.request_id}] Invalid date format: {str(e)}")
-        return jsonify({"error": "Invalid date format. Use ISO format (YYYY-MM-DDTHH:MM:SS)"}), 400
+        app.logger.error("Invalid date format: %s", e)
+        return _error_response("Invalid date format. Use ISO format (YYYY-MM-DDTHH:MM:SS)", 400)
     except Exception as e:
-        app.logger.error(f"[{g.request_id}] Error retrieving logs: {str(e)}\n{traceback.format_exc()}")
-        return jsonify({"error": "Error retrieving logs"}), 500
+        app.logger.exception("Error retrieving logs: %s", e)
+        return _error_response("Error retrieving logs", 500)
 
 @app.route("/api/v1/paraphrase_logs/summary", methods=["GET"])
 @auth.login_required
@@ -253,118 +732,146 @@ def get_paraphrase_logs_summary():
         days = request.args.get('days', default=7, type=int)
         
         # Calculate start time
-        start_dt = datetime.now() - timedelta(days=days)
+        now = datetime.now()
+        start_dt = now - timedelta(days=days)
         
-        # Get logs
-        logs = paraphrase_logger.get_logs(start_dt, None, limit=1000)
+        # Use the running counters when available, otherwise scan the logs
+        totals = paraphrase_logger.get_daily_totals(days)
+        if totals is not None:
+            # The counters cover whole calendar days: today and the days-1 before it
+            start_dt = (now - timedelta(days=days - 1)).replace(hour=0, minute=0, second=0, microsecond=0)
+        else:
+            logs = paraphrase_logger.get_logs(start_dt, None, limit=1000)
+            totals = (
+                len(logs),
+                sum(len(log['original_text']) for log in logs),
+                sum(len(log['paraphrased_text']) for log in logs)
+            )
+        count, original_length, paraphrased_length = totals
         
         # Generate summary
         summary = {
-            "total_paraphrases": len(logs),
+            "total_paraphrases": count,
             "time_period": f"Last {days} days",
             "start_date": start_dt.isoformat(),
-            "end_date": datetime.now().isoformat(),
-            "average_original_length": sum(len(log['original_text']) for log in logs) / len(logs) if logs else 0,
-            "average_paraphrased_length": sum(len(log['paraphrased_text']) for log in logs) / len(logs) if logs else 0,
+            "end_date": now.isoformat(),
+            "average_original_length": original_length / count if count else 0,
+            "average_paraphrased_length": paraphrased_length / count if count else 0,
         }
         
         return jsonify(summary), 200
 
     except Exception as e:
-        app.logger.error(f"[{g.request_id}] Error generating summary: {str(e)}\n{traceback.format_exc()}")
-        return jsonify({"error": "Error generating summary"}), 500
+        app.logger.exception("Error generating summary: %s", e)
+        return _error_response("Error generating summary", 500)
 
 @app.route("/api/v1/transcribe_with_time", methods=["POST"])
 @auth.login_required
 @limiter.limit("10 per minute")
 @monitor_api_call('transcribe_with_time')
 def transcribe_with_time():
-    if not client.api_key or client.api_key == "your_openai_api_key":
-        app.logger.error(f"[{g.request_id}] OpenAI API key not configured")
-        return jsonify({"error": "OpenAI API key not configured. Please set OPENAI_API_KEY in .env file"}), 500
+    error = _error_if_no_key()
+    if error:
+        return error
 
-    if "file" not in request.files:
-        app.logger.error(f"[{g.request_id}] No file part in request")
-        return jsonify({"error": "No file part"}), 400
-    
-    file = request.files["file"]
-    if file.filename == "":
-        app.logger.error(f"[{g.request_id}] No selected file")
-        return jsonify({"error": "No selected file"}), 400
+    file, error = _get_upload()
+    if error:
+        return error
 
     try:
-        # Generate a unique filename
-        temp_path = os.path.join(TEMP_DIR, f"temp_{g.request_id}")
-        
-        # Save the uploaded file
-        file.save(temp_path)
-        app.logger.info(f"[{g.request_id}] File saved to {temp_path}")
-        
-        try:
-            # Convert to mp3 (required by Whisper API)
-            audio = AudioSegment.from_file(temp_path)
-            audio.export(temp_path + ".mp3", format="mp3")
-            app.logger.info(f"[{g.request_id}] File converted to MP3")
-            
-            # Transcribe using OpenAI's Whisper API
-            with open(temp_path + ".mp3", "rb") as audio_file:
-                app.logger.info(f"[{g.request_id}] Starting transcription with Whisper API")
-                transcript = client.audio.transcriptions.create(
-                    model="whisper-1",
-                    file=audio_file
-                )
-            
-            # Format with timestamp
-            current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            formatted_response = f"{current_time}\n{transcript.text}"
-                
-            app.logger.info(f"[{g.request_id}] Successfully transcribed audio with timestamp")
-            return formatted_response, 200, {'Content-Type': 'text/plain'}
-            
-        finally:
-            # Clean up temporary files
-            try:
-                os.remove(temp_path)
-                if os.path.exists(temp_path + ".mp3"):
-                    os.remove(temp_path + ".mp3")
-            except Exception as e:
-                app.logger.error(f"[{g.request_id}] Error cleaning up temporary files: {str(e)}")
-                
+        transcript = _run_whisper(file)
+
+        # Format with timestamp
+        current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        formatted_response = f"{current_time}\n{transcript}"
+
+        app.logger.info("Successfully transcribed audio with timestamp")
+        return formatted_response, 200, {'Content-Type': 'text/plain'}
+
     except Exception as e:
-        app.logger.error(f"[{g.request_id}] Error processing audio file: {str(e)}\n{traceback.format_exc()}")
-        return jsonify({"error": str(e)}), 500
+        app.logger.exception("Error processing audio file: %s", e)
+        return _error_response(str(e), 500)
+
+@app.route("/api/v1/transcribe_async", methods=["POST"])
+@auth.login_required
+@limiter.limit("10 per minute")
+@monitor_api_call('transcribe_async')
+def transcribe_async():
+    error = _error_if_no_key()
+    if error:
+        return error
+
+    error = _error_if_no_broker()
+    if error:
+        return error
+
+    file, error = _get_upload()
+    if error:
+        return error
+
+    # Keep the extension, which tells the worker whether the file needs converting
+    path = os.path.join(UPLOAD_DIR, f"{uuid.uuid4().hex}.{get_audio_format(file.filename)}")
+    try:
+        os.makedirs(UPLOAD_DIR, exist_ok=True)
+        with open(path, "wb") as saved:
+            copy_buffers.copy(file.stream, saved)
+        result = transcribe_upload.delay(path, file.mimetype or None)
+    except Exception as e:
+        app.logger.exception("Error queueing transcription: %s", e)
+        if os.path.exists(path):
+            os.remove(path)
+        return _error_response("Error queueing audio file", 500)
+
+    app.logger.info("Queued transcription task %s", result.id)
+    return jsonify({"task_id": result.id, "status_url": f"/api/v1/tasks/{result.id}"}), 202
+
+@app.route("/api/v1/tasks/<task_id>", methods=["GET"])
+@auth.login_required
+@limiter.limit("60 per minute")
+@monitor_api_call('get_task')
+def get_task(task_id):
+    error = _error_if_no_broker()
+    if error:
+        return error
+
+    # Celery reports ids it doesn't know about as PENDING, as it does queued tasks
+    result = celery.AsyncResult(task_id)
+    response = {"task_id": task_id, "status": result.state}
+    if result.successful():
+        response["text"] = result.result
+    elif result.failed():
+        app.logger.error("Transcription task %s failed: %s", task_id, result.result)
+        response["error"] = "Error processing audio file"
+    return jsonify(response)
 
 # Error handler for rate limit exceeded
 @app.errorhandler(429)
 def ratelimit_handler(e):
-    app.logger.warning(f"Rate limit exceeded: {e.description}")
-    return jsonify({"error": f"Rate limit exceeded: {e.description}"}), 429
+    app.logger.warning("Rate limit exceeded: %s", e.description)
+    return _error_response(f"Rate limit exceeded: {e.description}", 429)
+
+# Error handler for uploads over MAX_CONTENT_LENGTH
+@app.errorhandler(413)
+def request_too_large_handler(e):
+    app.logger.warning("Request too large: %s bytes", request.content_length)
+    limit_mb = app.config["MAX_CONTENT_LENGTH"] // (1024 * 1024)
+    return _error_response(f"Request too large. The limit is {limit_mb} MB", 413)
 
 # Error handler for 404 Not Found
 @app.errorhandler(404)
 def not_found_error(e):
-    app.logger.info(f"404 error: {request.url}")
-    return jsonify({
-        "error": "The requested URL was not found",
-        "available_endpoints": {
-            "/": "API documentation",
-            "/api/v1/transcribe": "POST - Upload audio file for transcription (returns text/plain)",
-            "/api/v1/paraphrase": "POST - Paraphrase text (returns text/plain)",
-            "/api/v1/paraphrase_logs": "GET - View paraphrase logs (returns text/plain or JSON)",
-            "/api/v1/paraphrase_logs/summary": "GET - View paraphrase logs summary (returns JSON)",
-            "/api/v1/transcribe_with_time": "POST - Upload audio file for transcription with timestamp (returns text/plain)"
-        }
-    }), 404
+    app.logger.info("404 error: %s", request.url)
+    return NOT_FOUND_BODY, 404, JSON_HEADERS
 
 # Error handler for all other exceptions
 @app.errorhandler(Exception)
 def handle_exception(e):
-    app.logger.error(f"Unhandled exception: {str(e)}\n{traceback.format_exc()}")
-    return jsonify({"error": "Internal server error"}), 500
+    app.logger.exception("Unhandled exception: %s", e)
+    return _error_response("Internal server error", 500)
 
 if __name__ == '__main__':
     # Print debug information
-    app.logger.info(f"System PATH: {os.environ['PATH']}")
+    app.logger.info("System PATH: %s", os.environ['PATH'])
     
     # In development only
     app.run(debug=True, host="0.0.0.0", port=5000)
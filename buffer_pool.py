@@ -0,0 +1,56 @@
+import queue
+import shutil
+from contextlib import contextmanager
+from typing import BinaryIO, Iterator
+
+class BufferPool:
+    def __init__(self, count: int, size: int):
+        """
+        Bounded pool of reusable bytearrays for copying streams in chunks.
+
+        Buffers are allocated on first use and handed back after each copy, so
+        repeated conversions reuse the same few chunks instead of allocating a
+        fresh bytes object for every read.
+
+        Args:
+            count: Maximum number of idle buffers kept for reuse
+            size: Size of each buffer in bytes
+        """
+        self.size = size
+        self._buffers: "queue.LifoQueue[bytearray]" = queue.LifoQueue(count)
+
+    @contextmanager
+    def borrow(self) -> Iterator[bytearray]:
+        """Lend a buffer for the duration of the block; one is allocated if the pool is empty"""
+        try:
+            buffer = self._buffers.get_nowait()
+        except queue.Empty:
+            buffer = bytearray(self.size)
+        try:
+            yield buffer
+        finally:
+            try:
+                self._buffers.put_nowait(buffer)
+            except queue.Full:
+                pass
+
+    def copy(self, source: BinaryIO, destination: BinaryIO) -> None:
+        """
+        Copy a stream to another through a pooled buffer.
+
+        Args:
+            source: Stream to read until EOF
+            destination: Stream to write to
+        """
+        readinto = getattr(source, "readinto", None)
+        if readinto is None:
+            # Python 3.10's SpooledTemporaryFile has no readinto
+            shutil.copyfileobj(source, destination, self.size)
+            return
+
+        with self.borrow() as buffer, memoryview(buffer) as view:
+            while True:
+                length = readinto(buffer)
+                if not length:
+                    break
+                destination.write(view[:length])
@@ -0,0 +1,24 @@
+import os
+from celery import Celery
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Background transcription is opt-in: it needs a running Celery worker, which the
+# Docker image doesn't start, so REDIS_URL alone must not enable it. The broker
+# doubles as result backend unless one is set separately
+BROKER_URL = os.getenv("CELERY_BROKER_URL")
+RESULT_BACKEND = os.getenv("CELERY_RESULT_BACKEND", BROKER_URL)
+
+celery = Celery("vnt", broker=BROKER_URL, backend=RESULT_BACKEND, include=["app"])
+celery.conf.update(
+    task_serializer="json",
+    result_serializer="json",
+    accept_content=["json"],
+    # Transcriptions are long-running, so each worker process takes one at a time
+    # and a task is only acknowledged once it has finished
+    worker_prefetch_multiplier=1,
+    task_acks_late=True,
+    task_time_limit=300,
+    result_expires=int(os.getenv("CELERY_RESULT_EXPIRES", 24 * 60 * 60)),
+)
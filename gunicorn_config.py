@@ -1,14 +1,37 @@
 import multiprocessing
+import os
 
 # Gunicorn configuration
 bind = "127.0.0.1:8000"
-workers = multiprocessing.cpu_count() * 2 + 1
-worker_class = "sync"
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+# The app sizes its per-worker limits from the worker count
+os.environ["WEB_CONCURRENCY"] = str(workers)
+# Requests spend most of their time waiting on the OpenAI API, so each worker
+# serves them from a thread pool instead of blocking on one call at a time.
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", 16))
 worker_connections = 1000
 timeout = 30
 keepalive = 2
 
+# Import the app once in the master so workers start warm and share its memory
+preload_app = True
+
 # Logging
 accesslog = "access.log"
 errorlog = "error.log"
 loglevel = "info"
+
+def when_ready(server):
+    # Load the tokenizer before forking, so workers inherit it instead of each loading it
+    import app
+    try:
+        app.get_encoding(app.PARAPHRASE_MODEL)
+    except Exception as e:
+        server.log.warning("Could not preload tokenizer: %s", e)
+
+def post_fork(server, worker):
+    # The app was imported in the master, so each worker replaces the state it
+    # must not share with it
+    import app
+    app.init_worker_process()
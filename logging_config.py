@@ -1,92 +1,98 @@
 import os
+import itertools
 import logging
-from logging.handlers import RotatingFileHandler
+import time
+from concurrent_log_handler import ConcurrentRotatingFileHandler
 from datetime import datetime
-from flask import request, current_app, g
+from flask import current_app, g, has_app_context
+from flask.logging import default_handler
+
+# No formatter here uses the thread fields, so don't collect them for every record.
+# Process fields stay on: gunicorn and Celery include them in their own log lines
+logging.logThreads = False
+
+_default_record_factory = logging.getLogRecordFactory()
+
+def _request_record_factory(*args, **kwargs):
+    """Tag every log record with the ID of the request being handled, if any"""
+    record = _default_record_factory(*args, **kwargs)
+    record.request_id = g.get('request_id', '') if has_app_context() else ''
+    return record
 
 def setup_logging(app):
+    # Loggers are shared by name, so configuring the app again (reloader, tests)
+    # would otherwise add a second set of handlers and write every line twice
+    if getattr(app.logger, "_voice_note_taker_configured", False):
+        return
+    app.logger._voice_note_taker_configured = True
+    app.logger.propagate = False
+
     # Create logs directory if it doesn't exist
     logs_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "logs")
     os.makedirs(logs_dir, exist_ok=True)
 
+    # Attach the current request ID to records, so messages don't have to repeat it
+    logging.setLogRecordFactory(_request_record_factory)
+
     # Create custom formatter that includes request ID
     formatter = RequestFormatter(
-        '[%(asctime)s] %(levelname)s in %(module)s: %(request_id)s%(message)s'
+        '[%(asctime)s] %(levelname)s in %(module)s: %(request_tag)s%(message)s'
     )
     error_formatter = RequestFormatter(
-        '[%(asctime)s] %(levelname)s in %(module)s [in %(pathname)s:%(lineno)d]:\n%(request_id)s%(message)s'
+        '[%(asctime)s] %(levelname)s in %(module)s [in %(pathname)s:%(lineno)d]:\n%(request_tag)s%(message)s'
     )
 
-    # Configure file handler for all logs
+    # Configure file handler for all logs. Every gunicorn worker writes to the same
+    # files, so rotation is coordinated through a lock file
     all_logs_file = os.path.join(logs_dir, "app.log")
-    file_handler = RotatingFileHandler(all_logs_file, maxBytes=1024 * 1024, backupCount=10)
+    file_handler = ConcurrentRotatingFileHandler(all_logs_file, maxBytes=1024 * 1024, backupCount=10)
     file_handler.setFormatter(formatter)
     file_handler.setLevel(logging.INFO)
     app.logger.addHandler(file_handler)
 
     # Configure error-specific file handler
     error_logs_file = os.path.join(logs_dir, "error.log")
-    error_file_handler = RotatingFileHandler(error_logs_file, maxBytes=1024 * 1024, backupCount=10)
+    error_file_handler = ConcurrentRotatingFileHandler(error_logs_file, maxBytes=1024 * 1024, backupCount=10)
     error_file_handler.setFormatter(error_formatter)
     error_file_handler.setLevel(logging.ERROR)
     app.logger.addHandler(error_file_handler)
 
+    # Flask's own stderr handler is what shows up in the gunicorn and container logs
+    default_handler.setFormatter(formatter)
+
     # Set base logging level
     app.logger.setLevel(logging.INFO)
 
     # Log application startup
-    app.logger.info(f"Application started at {datetime.now().isoformat()}")
+    app.logger.info("Application started at %s", datetime.now().isoformat())
 
 class RequestFormatter(logging.Formatter):
     def format(self, record):
-        if hasattr(record, 'request_id'):
-            record.request_id = f"[Request ID: {record.request_id}] "
-        else:
-            record.request_id = ""
+        # Set a separate attribute so each handler formats the raw request ID
+        request_id = getattr(record, 'request_id', '')
+        record.request_tag = f"[Request ID: {request_id}] " if request_id else ""
         return super().format(record)
 
-def log_request_info(response):
-    """Log request information including status code, method, and path"""
-    status_code = response[1] if isinstance(response, tuple) else response.status_code
-    level = logging.WARNING if status_code >= 400 else logging.INFO
-    
-    message = f"Status: {status_code}, Method: {request.method}, Path: {request.path}"
-    if status_code >= 400:
-        error_msg = response[0].get_json().get('error', 'Unknown error') if isinstance(response, tuple) else response.get_json().get('error', 'Unknown error')
-        message += f", Error: {error_msg}"
-    
-    record = logging.LogRecord(
-        name=current_app.logger.name,
-        level=level,
-        pathname=__file__,
-        lineno=0,
-        msg=message,
-        args=(),
-        exc_info=None
-    )
-    record.request_id = getattr(request, 'request_id', 'NO_REQUEST_ID')
-    current_app.logger.handle(record)
-    return response
+def _reset_request_ids():
+    # Start time and PID keep IDs unique across workers and restarts; the counter
+    # makes them unique within the process
+    global _request_id_prefix, _next_request_number
+    _request_id_prefix = f"{int(time.time()) & 0xffffffff:08x}{os.getpid() & 0xffff:04x}"
+    _next_request_number = itertools.count().__next__
+
+_reset_request_ids()
+# The app may be imported before gunicorn forks its workers
+os.register_at_fork(after_in_child=_reset_request_ids)
 
 def get_request_id():
     """Generate a unique request ID"""
-    return datetime.now().strftime('%Y%m%d%H%M%S-') + os.urandom(4).hex()
-
-def log_api_call(endpoint_name, duration_ms, response):
-    """Log API call details"""
-    request_id = getattr(g, 'request_id', '')
-    if isinstance(response, tuple):
-        status_code = response[1]
-        response_data = response[0].get_json() if hasattr(response[0], 'get_json') else str(response[0])
-    else:
-        status_code = response.status_code
-        response_data = response.get_json() if hasattr(response, 'get_json') else str(response)
-    
-    message = (
-        f"[{request_id}] {endpoint_name} completed in {duration_ms:.2f}ms "
-        f"with status {status_code}"
-    )
-    
-    level = logging.INFO if status_code < 400 else logging.ERROR
-    current_app.logger.log(level, message)
-    return status_code
+    return f"{_request_id_prefix}{_next_request_number() & 0xffffffff:08x}"
+
+def log_openai_response(response):
+    """httpx response hook linking our request ID to OpenAI's, for tracing calls with OpenAI support"""
+    if has_app_context():
+        current_app.logger.debug(
+            "OpenAI %s %s returned %s (OpenAI request ID: %s)",
+            response.request.method, response.request.url.path,
+            response.status_code, response.headers.get("x-request-id")
+        )
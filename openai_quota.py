@@ -0,0 +1,82 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Iterator, Tuple
+
+import openai
+from tenacity import RetryCallState, retry, stop_after_attempt, wait_exponential_jitter
+
+class OpenAIQuotaManager:
+    """
+    Client-side guard for the OpenAI API limits.
+
+    Caps the number of in-flight requests and keeps a sliding one-minute window
+    of request and token usage, so callers wait for capacity instead of being
+    rejected with a 429. Limits are enforced per process.
+    """
+
+    def __init__(self, rpm: int, tpm: int, max_concurrent_requests: int, window: float = 60.0):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.window = window
+        self._slots = threading.BoundedSemaphore(max_concurrent_requests)
+        self._lock = threading.Lock()
+        self._usage: Deque[Tuple[float, int, int]] = deque()
+        self._requests = 0
+        self._tokens = 0
+
+    def _expire(self, now: float) -> None:
+        while self._usage and now - self._usage[0][0] >= self.window:
+            _, requests, tokens = self._usage.popleft()
+            self._requests -= requests
+            self._tokens -= tokens
+
+    def _acquire(self, requests: int, tokens: int) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._expire(now)
+                # An empty window always admits the reservation, even one larger
+                # than the limits, so oversized requests cannot wait forever
+                fits = (self._requests + requests <= self.rpm and
+                        self._tokens + tokens <= self.tpm)
+                if fits or not self._usage:
+                    self._usage.append((now, requests, tokens))
+                    self._requests += requests
+                    self._tokens += tokens
+                    return
+                delay = self.window - (now - self._usage[0][0])
+            time.sleep(delay)
+
+    @contextmanager
+    def reserve(self, requests: int = 1, tokens: int = 0) -> Iterator[None]:
+        """
+        Block until the call fits within the concurrency, RPM and TPM limits.
+
+        Args:
+            requests: Number of API requests the call makes
+            tokens: Estimated number of tokens the call consumes
+        """
+        with self._slots:
+            self._acquire(requests, tokens)
+            yield
+
+def _should_retry(retry_state: RetryCallState) -> bool:
+    error = retry_state.outcome.exception()
+    if isinstance(error, openai.RateLimitError):
+        return True
+    # The client is built with the SDK's own retries off, so connection failures
+    # and 5xx responses get the one extra attempt they used to get from the SDK.
+    # Timeouts are included, but only once: each attempt can take the full read timeout
+    return (isinstance(error, (openai.APIConnectionError, openai.InternalServerError))
+            and retry_state.attempt_number < 2)
+
+# The only retry layer for OpenAI calls. Rate limits are retried up to five times with
+# jittered exponential backoff, so a burst of 429s doesn't retry in lockstep
+openai_retry = retry(
+    wait=wait_exponential_jitter(initial=1, max=60),
+    retry=_should_retry,
+    stop=stop_after_attempt(5),
+    reraise=True,
+)
@@ -0,0 +1,86 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, List, Optional, Tuple
+
+class ParaphraseBatcher:
+    def __init__(self, process_batch: Callable[[List[Any]], List[str]],
+                 window: float = 0.05, max_batch_size: int = 8, max_concurrent_batches: int = 4):
+        """
+        Coalesce paraphrase requests that arrive close together into batches.
+
+        The first request starts a collection window; everything submitted
+        before it closes, up to max_batch_size, is handed to process_batch in
+        a single call, which spreads the fixed per-call cost of an OpenAI
+        request across the batch.
+
+        Args:
+            process_batch: Paraphrases a list of submitted items, returning results in the same order
+            window: Seconds to wait for more requests after the first one arrives
+            max_batch_size: Maximum number of texts per batch
+            max_concurrent_batches: Number of batches processed in parallel
+        """
+        self._process_batch = process_batch
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self.max_concurrent_batches = max_concurrent_batches
+        self._lock = threading.Lock()
+        self._pid: Optional[int] = None
+        self._queue: "queue.Queue[Tuple[Any, Future]]" = queue.Queue()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._collector: Optional[threading.Thread] = None
+
+    def submit(self, item: Any) -> str:
+        """
+        Queue an item for the next batch and wait for its paraphrase.
+
+        Args:
+            item: The text to paraphrase, in whatever form process_batch expects
+
+        Returns:
+            The paraphrased text
+        """
+        self._ensure_started()
+        future: Future = Future()
+        self._queue.put((item, future))
+        return future.result()
+
+    def _ensure_started(self) -> None:
+        # Threads don't survive a fork, so start them lazily in each worker process
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._queue = queue.Queue()
+            self._executor = ThreadPoolExecutor(max_workers=self.max_concurrent_batches,
+                                                thread_name_prefix="paraphrase-batch")
+            self._collector = threading.Thread(target=self._collect, name="paraphrase-batcher", daemon=True)
+            self._collector.start()
+
+    def _collect(self) -> None:
+        while True:
+            items = [self._queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(items) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    items.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._executor.submit(self._run_batch, items)
+
+    def _run_batch(self, items: List[Tuple[Any, Future]]) -> None:
+        try:
+            results = self._process_batch([item for item, _ in items])
+            if len(results) != len(items):
+                raise ValueError(f"Expected {len(items)} paraphrases, got {len(results)}")
+        except Exception as e:
+            for _, future in items:
+                future.set_exception(e)
+            return
+        for (_, future), result in zip(items, results):
+            future.set_result(result)
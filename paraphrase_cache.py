@@ -0,0 +1,115 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+from flask import current_app
+from redis_store import get_redis
+
+class ParaphraseCache:
+    def __init__(self, ttl: int = 86400, stale_ttl: int = 7 * 86400, max_local_entries: int = 1024):
+        """
+        Cache of paraphrase results keyed by a hash of the model, prompt and text.
+
+        Entries live in Redis when REDIS_URL is configured, otherwise in a
+        per-process LRU. Expired entries are kept for stale_ttl as a last known
+        good result to serve when OpenAI is failing.
+
+        Args:
+            ttl: Seconds a cached paraphrase stays valid
+            stale_ttl: Seconds a paraphrase remains available through get_stale
+            max_local_entries: Size of the in-process LRU used without Redis
+        """
+        self.ttl = ttl
+        self.stale_ttl = max(stale_ttl, ttl)
+        self.max_local_entries = max_local_entries
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(model: str, system_prompt: str, text: str) -> str:
+        digest = hashlib.blake2b(f"{model}\0{system_prompt}\0{text}".encode("utf-8"), digest_size=16)
+        return "para:" + digest.hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Look up a cached paraphrase.
+
+        Args:
+            key: Cache key from make_key
+
+        Returns:
+            The cached paraphrase, or None on a miss
+        """
+        redis_client = get_redis()
+        if redis_client is not None:
+            try:
+                cached = redis_client.get(key)
+            except Exception as e:
+                current_app.logger.warning("Error reading paraphrase cache: %s", e)
+                return None
+            return cached.decode("utf-8") if cached is not None else None
+
+        return self._get_local(key, stale=False)
+
+    def get_stale(self, key: str) -> Optional[str]:
+        """
+        Look up the last known paraphrase for a key, even if it has expired.
+
+        Args:
+            key: Cache key from make_key
+
+        Returns:
+            The most recent paraphrase stored within stale_ttl, or None
+        """
+        redis_client = get_redis()
+        if redis_client is not None:
+            try:
+                cached = redis_client.get(key + ":stale")
+            except Exception as e:
+                current_app.logger.warning("Error reading stale paraphrase cache: %s", e)
+                return None
+            return cached.decode("utf-8") if cached is not None else None
+
+        return self._get_local(key, stale=True)
+
+    def _get_local(self, key: str, stale: bool) -> Optional[str]:
+        with self._lock:
+            entry = self._local.get(key)
+            if entry is None:
+                return None
+            expires_at, stale_until, value = entry
+            now = time.monotonic()
+            if stale_until < now:
+                del self._local[key]
+                return None
+            if not stale and expires_at < now:
+                return None
+            self._local.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str) -> None:
+        """
+        Store a paraphrase result.
+
+        Args:
+            key: Cache key from make_key
+            value: The paraphrased text
+        """
+        redis_client = get_redis()
+        if redis_client is not None:
+            try:
+                pipe = redis_client.pipeline(transaction=False)
+                pipe.set(key, value, ex=self.ttl)
+                pipe.set(key + ":stale", value, ex=self.stale_ttl)
+                pipe.execute()
+            except Exception as e:
+                current_app.logger.warning("Error writing paraphrase cache: %s", e)
+            return
+
+        with self._lock:
+            now = time.monotonic()
+            self._local[key] = (now + self.ttl, now + self.stale_ttl, value)
+            self._local.move_to_end(key)
+            while len(self._local) > self.max_local_entries:
+                self._local.popitem(last=False)
@@ -1,8 +1,42 @@
 import os
-import json
-from datetime import datetime
-from typing import Dict, Optional, List
+import atexit
+import queue
+import threading
+import orjson
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, Optional, List, Tuple
 from flask import current_app
+from redis_store import get_redis
+
+# Days the per-day paraphrase counters are kept in Redis
+COUNTER_RETENTION_DAYS = 90
+
+# Entries waiting for the writer thread, and how many it writes at once
+MAX_PENDING_ENTRIES = 10_000
+MAX_WRITE_BATCH = 256
+
+# The log is read backwards in blocks of this size
+READ_CHUNK_SIZE = 64 * 1024
+# Workers stamp entries before queueing them, so lines may land slightly out of
+# timestamp order; reading continues this far past the start of the range
+TIMESTAMP_SLACK = timedelta(minutes=1)
+
+def _read_lines_backwards(f, chunk_size: int = READ_CHUNK_SIZE) -> Iterator[bytes]:
+    """Yield the lines of a binary file from last to first, reading it in chunks from the end"""
+    position = f.seek(0, os.SEEK_END)
+    remainder = b""
+    while position > 0:
+        read_size = min(chunk_size, position)
+        position -= read_size
+        f.seek(position)
+        lines = (f.read(read_size) + remainder).split(b"\n")
+        # The first piece may be the tail of a line that starts in an earlier chunk
+        remainder = lines.pop(0)
+        for line in reversed(lines):
+            if line:
+                yield line
+    if remainder:
+        yield remainder
 
 class ParaphraseLogger:
     def __init__(self):
@@ -10,8 +44,12 @@ class ParaphraseLogger:
         self.logs_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "logs")
         os.makedirs(self.logs_dir, exist_ok=True)
         self.paraphrase_log_file = os.path.join(self.logs_dir, "paraphrase_logs.jsonl")
+        self._lock = threading.Lock()
+        self._pid: Optional[int] = None
+        self._queue: "queue.Queue[Dict]" = queue.Queue(MAX_PENDING_ENTRIES)
 
-    def log_paraphrase(self, request_id: str, original_text: str, paraphrased_text: str) -> None:
+    def log_paraphrase(self, request_id: str, original_text: str, paraphrased_text: str,
+                       stale: bool = False) -> None:
         """
         Log a paraphrase entry to the log file.
         
@@ -19,6 +57,7 @@ class ParaphraseLogger:
             request_id: Unique identifier for the request
             original_text: The original text that was paraphrased
             paraphrased_text: The paraphrased version of the text
+            stale: Whether an expired cached paraphrase was served because OpenAI failed
         """
         log_entry = {
             "timestamp": datetime.now().isoformat(),
@@ -26,20 +65,121 @@ class ParaphraseLogger:
             "original_text": original_text,
             "paraphrased_text": paraphrased_text
         }
+        if stale:
+            log_entry["stale"] = True
         
+        # The entry is written by a background thread, so the request doesn't wait on disk
+        try:
+            self._ensure_started()
+            self._queue.put_nowait(log_entry)
+            current_app.logger.info("Queued paraphrase result for logging")
+        except queue.Full:
+            current_app.logger.error("Error logging paraphrase: log writer is falling behind")
+        except Exception as e:
+            current_app.logger.error("Error logging paraphrase: %s", e)
+
+        self._update_counters(len(original_text), len(paraphrased_text))
+
+    def _ensure_started(self) -> None:
+        # Threads don't survive a fork, so start the writer lazily in each worker process
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # Open here rather than in the thread, so a failure reaches the caller
+            log_file = open(self.paraphrase_log_file, "ab", buffering=1 << 16)
+            self._queue = queue.Queue(MAX_PENDING_ENTRIES)
+            threading.Thread(target=self._write_entries, args=(log_file, self._queue, current_app.logger),
+                             name="paraphrase-log-writer", daemon=True).start()
+            self._pid = os.getpid()
+            atexit.register(self.flush)
+
+    def _write_entries(self, log_file, entries: "queue.Queue[Dict]", logger) -> None:
+        with log_file as f:
+            while True:
+                # Everything queued while the previous batch was written goes out in one write
+                batch = [entries.get()]
+                while len(batch) < MAX_WRITE_BATCH:
+                    try:
+                        batch.append(entries.get_nowait())
+                    except queue.Empty:
+                        break
+                try:
+                    f.write(b"".join(orjson.dumps(entry) + b"\n" for entry in batch))
+                    f.flush()
+                except Exception as e:
+                    logger.error("Error logging %d paraphrases: %s", len(batch), e)
+                finally:
+                    for _ in batch:
+                        entries.task_done()
+
+    def flush(self) -> None:
+        """Wait until every queued paraphrase entry has been written to the log file"""
+        if self._pid == os.getpid():
+            self._queue.join()
+
+    def _update_counters(self, original_length: int, paraphrased_length: int) -> None:
+        """Add a paraphrase to today's count and length totals in Redis, if configured"""
+        redis_client = get_redis()
+        if redis_client is None:
+            return
+
+        day = datetime.now().strftime("%Y%m%d")
+        ttl = timedelta(days=COUNTER_RETENTION_DAYS)
         try:
-            with open(self.paraphrase_log_file, "a", encoding="utf-8") as f:
-                json.dump(log_entry, f, ensure_ascii=False)
-                f.write("\n")
-            current_app.logger.info(f"[{request_id}] Successfully logged paraphrase result")
+            pipe = redis_client.pipeline(transaction=False)
+            for name, amount in (("cnt", 1), ("olen", original_length), ("plen", paraphrased_length)):
+                key = f"para:{name}:{day}"
+                pipe.incrby(key, amount)
+                pipe.expire(key, ttl)
+            pipe.execute()
         except Exception as e:
-            current_app.logger.error(f"[{request_id}] Error logging paraphrase: {str(e)}")
+            current_app.logger.warning("Error updating paraphrase counters: %s", e)
+
+    def get_daily_totals(self, days: int) -> Optional[Tuple[int, int, int]]:
+        """
+        Sum the per-day paraphrase counters kept in Redis.
+
+        Args:
+            days: Number of calendar days to include, counting today
+
+        Returns:
+            Total paraphrases, original text length and paraphrased text length,
+            or None when the counters are unavailable and the log must be scanned
+        """
+        redis_client = get_redis()
+        if redis_client is None or days > COUNTER_RETENTION_DAYS:
+            return None
+
+        today = datetime.now()
+        day_keys = [(today - timedelta(days=offset)).strftime("%Y%m%d") for offset in range(days)]
+        keys = [f"para:{name}:{day}" for name in ("cnt", "olen", "plen") for day in day_keys]
+        try:
+            values = redis_client.mget(keys)
+        except Exception as e:
+            current_app.logger.warning("Error reading paraphrase counters: %s", e)
+            return None
+
+        totals = [int(value) if value is not None else 0 for value in values]
+        return sum(totals[:days]), sum(totals[days:2 * days]), sum(totals[2 * days:])
+
+    @staticmethod
+    def _as_log_timestamp(value: Optional[datetime]) -> Optional[str]:
+        """Format a filter bound like the log timestamps: naive local time in ISO format"""
+        if value is None:
+            return None
+        if value.tzinfo is not None:
+            try:
+                value = value.astimezone().replace(tzinfo=None)
+            except OverflowError:
+                # Within a day of the datetime range; clamp to the end it fell off
+                value = datetime.min if value.year == datetime.min.year else datetime.max
+        return value.isoformat()
 
     def get_logs(self, start_time: Optional[datetime] = None, 
                 end_time: Optional[datetime] = None, 
                 limit: int = 100) -> List[Dict]:
         """
-        Retrieve paraphrase logs within the specified time range.
+        Retrieve the most recent paraphrase logs within the specified time range.
         
         Args:
             start_time: Optional start time filter
@@ -47,33 +187,47 @@ class ParaphraseLogger:
             limit: Maximum number of logs to return (default: 100)
             
         Returns:
-            List of log entries matching the criteria
+            List of log entries matching the criteria, oldest first
         """
+        # Timestamps are written with datetime.isoformat(), so they order correctly
+        # as strings and entries can be filtered without parsing each one
+        start_iso = self._as_log_timestamp(start_time)
+        end_iso = self._as_log_timestamp(end_time)
+        stop_iso = None
+        if start_time and start_time - datetime.min.replace(tzinfo=start_time.tzinfo) > TIMESTAMP_SLACK:
+            stop_iso = self._as_log_timestamp(start_time - TIMESTAMP_SLACK)
+
+        self.flush()
         logs = []
         try:
-            with open(self.paraphrase_log_file, "r", encoding="utf-8") as f:
-                for line in f:
+            # Entries are appended in time order, so reading from the end touches only
+            # the lines in the requested range instead of the whole file
+            with open(self.paraphrase_log_file, "rb") as f:
+                for line in _read_lines_backwards(f):
                     try:
-                        entry = json.loads(line)
-                        entry_time = datetime.fromisoformat(entry["timestamp"])
+                        entry = orjson.loads(line)
+                        entry_time = entry["timestamp"]
                         
                         # Apply time filters if specified
-                        if start_time and entry_time < start_time:
+                        if stop_iso and entry_time < stop_iso:
+                            break
+                        if start_iso and entry_time < start_iso:
                             continue
-                        if end_time and entry_time > end_time:
+                        if end_iso and entry_time > end_iso:
                             continue
                             
                         logs.append(entry)
                         if len(logs) >= limit:
                             break
-                    except json.JSONDecodeError:
-                        current_app.logger.warning(f"Skipping invalid log entry: {line}")
+                    except orjson.JSONDecodeError:
+                        current_app.logger.warning("Skipping invalid log entry: %r", line)
                         continue
                         
         except FileNotFoundError:
             current_app.logger.warning("No paraphrase logs found")
             return []
         
+        logs.reverse()
         return logs
 
 # Create a global instance
@@ -0,0 +1,39 @@
+import os
+from typing import Optional
+
+import redis
+
+# Upper bound on open Redis connections per worker process; callers beyond it
+# wait for a free connection instead of opening new ones
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", 64))
+
+_pool: Optional[redis.BlockingConnectionPool] = None
+_client: Optional[redis.Redis] = None
+
+def get_connection_pool() -> Optional[redis.BlockingConnectionPool]:
+    """
+    Return the connection pool shared by every Redis user in the process.
+
+    Returns:
+        The pool for REDIS_URL, or None when Redis is not configured
+    """
+    global _pool
+    if _pool is None:
+        redis_url = os.getenv("REDIS_URL")
+        if redis_url:
+            _pool = redis.BlockingConnectionPool.from_url(redis_url, max_connections=REDIS_MAX_CONNECTIONS)
+    return _pool
+
+def get_redis() -> Optional[redis.Redis]:
+    """
+    Return the shared Redis client, created on first use.
+
+    Returns:
+        The client for REDIS_URL, or None when Redis is not configured
+    """
+    global _client
+    if _client is None:
+        pool = get_connection_pool()
+        if pool is not None:
+            _client = redis.Redis(connection_pool=pool)
+    return _client